@@ -1,10 +1,35 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from datetime import datetime
+from io import BytesIO
 import os
-from fpdf import FPDF
-import base64
+import csv
+import json
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows has no flock
+    fcntl = None
+from xml.sax.saxutils import escape
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+# ----- Settings -----
+CURRENCY = "Rs."
+USER_LOG_FILE = "user_log.txt"
+COLUMNS = ["Date", "Type", "Category", "Amount"]
+TRANSACTION_TYPES = ["Income", "Expense"]
+# Only empty fields count as missing, so categories like "None" or "N/A" stay text
+CSV_OPTIONS = {
+    "parse_dates": ["Date"],
+    "dtype": {"Type": "category", "Category": "category", "Amount": "float64"},
+    "keep_default_na": False,
+    "na_values": [""],
+}
 
 # ----- Streamlit Setup -----
 st.set_page_config(page_title="💰 Advanced Budget Tracker", layout="centered")
@@ -19,171 +44,356 @@ st.markdown("""
 st.title("💸 Personal Budget Tracker")
 
 # ----- Developer-only User Tracking -----
-user_log_file = "user_log.txt"
-
 def log_user(username):
-    if os.path.exists(user_log_file):
-        with open(user_log_file, "r") as f:
-            existing_users = f.read().splitlines()
-    else:
-        existing_users = []
-
-    if username not in existing_users:
-        with open(user_log_file, "a") as f:
-            f.write(f"{username}\n")
-
-# ----- User Login -----
-st.sidebar.header("👤 User Login")
-username = st.sidebar.text_input("Enter your name to continue")
-
-if not username:
-    st.warning("Please enter your name in the sidebar to proceed.")
-    st.stop()
-
-log_user(username)
-
-filename = f"{username.lower().replace(' ', '_')}_transactions.csv"
-
-# Load existing data or initialize
-if os.path.exists(filename):
-    df = pd.read_csv(filename)
-else:
-    df = pd.DataFrame(columns=["Date", "Type", "Category", "Amount"])
-
-# Ensure Date column is datetime
-if not df.empty:
-    df["Date"] = pd.to_datetime(df["Date"])
-
-st.session_state["df"] = df
-
-# ----- Add Transaction -----
-with st.form("transaction_form"):
-    st.subheader("➕ Add New Transaction")
-    t_type = st.selectbox("Type", ["Income", "Expense"])
-    category = st.text_input("Category (e.g., Rent, Food, Salary)")
-    amount = st.number_input("Amount", min_value=0.0, format="%.2f")
-    date_input = st.date_input("Transaction Date", value=datetime.today().date())
-    submitted = st.form_submit_button("Add")
-
-    if submitted:
-        if category and amount > 0:
-            new_data = {
-                "Date": pd.to_datetime(str(date_input)),
-                "Type": t_type,
-                "Category": category.strip().title(),
-                "Amount": amount
-            }
-            st.session_state["df"] = pd.concat([st.session_state["df"], pd.DataFrame([new_data])], ignore_index=True)
-            st.session_state["df"].to_csv(filename, index=False)
-            st.success(f"{t_type} of Rs. {amount:.2f} added under '{category}'")
-            st.rerun()
+    # Users already in the log, read once per session
+    if "users_seen" not in st.session_state:
+        if os.path.exists(USER_LOG_FILE):
+            with open(USER_LOG_FILE, "r") as f:
+                st.session_state["users_seen"] = set(f.read().splitlines())
         else:
-            st.warning("Please enter valid details.")
+            st.session_state["users_seen"] = set()
 
-df = st.session_state["df"]
+    if username not in st.session_state["users_seen"]:
+        with open(USER_LOG_FILE, "a") as f:
+            f.write(f"{username}\n")
+        st.session_state["users_seen"].add(username)
+
+# ----- Storage -----
+@contextmanager
+def storage_lock(pending_path):
+    # One lock per user around every read and write of their data files
+    with open(f"{pending_path}.lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def build_aggregates(dataframe):
+    # Per-type totals by category (pie chart, summary) and by day (trend chart)
+    aggregates = {t_type: {"categories": {}, "days": {}} for t_type in TRANSACTION_TYPES}
+    if dataframe.empty:
+        return aggregates
+    by_category = dataframe.groupby(["Type", "Category"], observed=True)["Amount"].sum()
+    for (t_type, cat), amt in by_category.items():
+        aggregates[t_type]["categories"][cat] = round(float(amt), 2)
+    days = dataframe["Date"].dt.strftime("%Y-%m-%d")
+    by_day = dataframe.groupby(["Type", days], observed=True)["Amount"].sum()
+    for (t_type, day), amt in by_day.items():
+        aggregates[t_type]["days"][day] = round(float(amt), 2)
+    return aggregates
+
+# Caches keyed on file versions only need the latest few entries
+CACHE_ENTRIES = 16
+
+def file_version(path):
+    # Size is included since two quick writes can share an mtime
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def stored_version(path, pending_path):
+    # Versions of both data files, as lists so they compare equal after json
+    return [list(v) if v is not None else None for v in (file_version(path), file_version(pending_path))]
+
+def write_aggregates(totals, version, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": version, "totals": totals}, f)
+    os.replace(tmp_path, path)
+
+def bump_aggregates(row, path, before_version, after_version):
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        aggregates = json.load(f)
+    # A stale sidecar is left for the next load to rebuild
+    if aggregates.get("version") != before_version:
+        return
+    totals = aggregates["totals"][row["Type"]]
+    totals["categories"][row["Category"]] = round(totals["categories"].get(row["Category"], 0.0) + row["Amount"], 2)
+    totals["days"][row["Date"]] = round(totals["days"].get(row["Date"], 0.0) + row["Amount"], 2)
+    write_aggregates(aggregates["totals"], after_version, path)
+
+def write_df(dataframe, path, pending_path, aggregates_path):
+    # Caller holds storage_lock; the Parquet file is replaced atomically via a temp file
+    tmp_path = f"{path}.tmp"
+    dataframe.to_parquet(tmp_path, engine="pyarrow", compression="zstd", index=False)
+    os.replace(tmp_path, path)
+    if os.path.exists(pending_path):
+        os.remove(pending_path)
+    write_aggregates(build_aggregates(dataframe), stored_version(path, pending_path), aggregates_path)
+
+def save_df(dataframe, path, pending_path, aggregates_path):
+    with storage_lock(pending_path):
+        write_df(dataframe, path, pending_path, aggregates_path)
+
+def append_pending(row, path, pending_path, aggregates_path):
+    with storage_lock(pending_path):
+        before_version = stored_version(path, pending_path)
+        write_header = not os.path.exists(pending_path)
+        with open(pending_path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(COLUMNS)
+            writer.writerow([row[col] for col in COLUMNS])
+        bump_aggregates(row, aggregates_path, before_version, stored_version(path, pending_path))
+
+@st.cache_data(max_entries=CACHE_ENTRIES)
+def load_df(path, version, pending_path, pending_version):
+    # The versions are only used as part of the cache key
+    frames = []
+    if version is not None:
+        frames.append(pd.read_parquet(path, engine="pyarrow"))
+    if pending_version is not None:
+        frames.append(pd.read_csv(pending_path, **CSV_OPTIONS))
+    if frames:
+        dataframe = pd.concat(frames, ignore_index=True)
+    else:
+        dataframe = pd.DataFrame(columns=COLUMNS)
+    # Stable sort, so same-day rows keep insert order
+    dataframe = dataframe.sort_values("Date", kind="mergesort", ignore_index=True)
+    dataframe["Type"] = dataframe["Type"].astype(pd.CategoricalDtype(TRANSACTION_TYPES))
+    dataframe["Category"] = dataframe["Category"].astype("category")
+    return dataframe
+
+@st.cache_data(max_entries=CACHE_ENTRIES)
+def load_aggregates(path, version):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def load_user_data(filename, pending_filename, legacy_filename, aggregates_filename):
+    with storage_lock(pending_filename):
+        # One-time migration from the old CSV storage
+        if os.path.exists(legacy_filename) and not os.path.exists(filename):
+            legacy_df = pd.read_csv(legacy_filename, **CSV_OPTIONS)
+            write_df(legacy_df, filename, pending_filename, aggregates_filename)
+            os.remove(legacy_filename)
+
+        df = load_df(filename, file_version(filename), pending_filename, file_version(pending_filename))
+
+        # Rebuild the aggregates if they weren't computed from the files just loaded
+        data_version = stored_version(filename, pending_filename)
+        aggregates_version = file_version(aggregates_filename)
+        sidecar = load_aggregates(aggregates_filename, aggregates_version) if aggregates_version else {}
+        if sidecar.get("version") != data_version:
+            write_aggregates(build_aggregates(df), data_version, aggregates_filename)
+            aggregates_version = file_version(aggregates_filename)
+            sidecar = load_aggregates(aggregates_filename, aggregates_version)
+    return df, sidecar["totals"], (aggregates_filename, aggregates_version)
+
+# ----- Aggregations & Charts -----
+# Cached on the aggregates file version; the leading underscore skips hashing the dict
+@st.cache_data(max_entries=CACHE_ENTRIES)
+def compute_summary(_aggregates, aggregates_version):
+    income = sum(_aggregates["Income"]["categories"].values())
+    expenses = sum(_aggregates["Expense"]["categories"].values())
+    pie_data = pd.Series(_aggregates["Expense"]["categories"], dtype="float64").sort_index()
+    return income, expenses, pie_data
+
+@st.cache_data(max_entries=CACHE_ENTRIES)
+def compute_trend(_aggregates, aggregates_version):
+    # Long format: one row per date and type
+    trend = pd.DataFrame(
+        [(day, t_type, amt) for t_type in TRANSACTION_TYPES for day, amt in _aggregates[t_type]["days"].items()],
+        columns=["Date", "Type", "Amount"]
+    )
+    trend["Date"] = pd.to_datetime(trend["Date"])
+    return trend.sort_values("Date", kind="mergesort", ignore_index=True)
+
+# Rendered to PNG bytes so no Figure is shared between sessions
+@st.cache_data(max_entries=CACHE_ENTRIES)
+def make_pie(items):
+    labels, values = zip(*items)
+    fig = Figure()
+    ax = fig.subplots()
+    ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=90)
+    ax.axis("equal")
+    buffer = BytesIO()
+    # Same output settings st.pyplot uses
+    fig.savefig(buffer, format="png", bbox_inches="tight", dpi=200)
+    return buffer.getvalue()
+
+# ----- PDF Report -----
+def generate_pdf(username, dataframe, total_income, total_expenses, balance_amt):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = getSampleStyleSheet()
+
+    story = [
+        # Paragraph text is parsed as markup
+        Paragraph(f"{escape(username.title())}'s Budget Report", styles["Title"]),
+        Spacer(1, 10 * mm),
+        Paragraph(f"Total Income: {CURRENCY} {total_income:.2f}", styles["Normal"]),
+        Paragraph(f"Total Expenses: {CURRENCY} {total_expenses:.2f}", styles["Normal"]),
+        Paragraph(f"Current Balance: {CURRENCY} {balance_amt:.2f}", styles["Normal"]),
+        Spacer(1, 10 * mm),
+    ]
+
+    dates = dataframe["Date"].dt.strftime("%Y-%m-%d").to_numpy()
+    types = dataframe["Type"].to_numpy()
+    categories = dataframe["Category"].to_numpy()
+    amounts = dataframe["Amount"].to_numpy()
+    rows = [[date_str, txn_type, cat, f"{CURRENCY} {amt:.2f}"] for date_str, txn_type, cat, amt in zip(dates, types, categories, amounts)]
+
+    # One table per page, sized from the row height and the space left on the first
+    # page, so reportlab never has to split a table at a page break
+    col_widths = [40 * mm, 30 * mm, 60 * mm, 30 * mm]
+    table_style = TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 10),
+    ])
+    frame_height = doc.height - 12  # Frame's default 6pt top and bottom padding
+    row_height = Table([COLUMNS], colWidths=col_widths, style=table_style).wrap(doc.width, frame_height)[1]
+    used_height = sum(f.wrap(doc.width, frame_height)[1] + f.getSpaceBefore() + f.getSpaceAfter() for f in story)
+    first_page_rows = max(int((frame_height - used_height) // row_height) - 1, 0)
+    rows_per_page = int(frame_height // row_height) - 1
+    bounds = sorted({0, *range(first_page_rows, len(rows), rows_per_page), len(rows)})
+    for start, end in zip(bounds, bounds[1:]):
+        story.append(Table([COLUMNS] + rows[start:end], colWidths=col_widths, style=table_style))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+# ----- Page Sections -----
+def render_add_form(filename, pending_filename, aggregates_filename):
+    with st.form("transaction_form"):
+        st.subheader("➕ Add New Transaction")
+        t_type = st.selectbox("Type", TRANSACTION_TYPES)
+        category = st.text_input("Category (e.g., Rent, Food, Salary)")
+        amount = st.number_input("Amount", min_value=0.0, format="%.2f")
+        date_input = st.date_input("Transaction Date", value=datetime.today().date())
+        submitted = st.form_submit_button("Add")
+
+        if submitted:
+            if category and amount > 0:
+                new_data = {
+                    "Date": date_input.isoformat(),
+                    "Type": t_type,
+                    "Category": category.strip().title(),
+                    "Amount": amount
+                }
+                append_pending(new_data, filename, pending_filename, aggregates_filename)
+                st.success(f"{t_type} of {CURRENCY} {amount:.2f} added under '{category}'")
+                st.rerun()
+            else:
+                st.warning("Please enter valid details.")
 
-# ----- Edit/Delete Transactions -----
-if not df.empty:
+def render_edit_form(df, filename, pending_filename, aggregates_filename):
     st.subheader("✏️ Edit or Delete Transactions")
+    labels = [
+        f"{date_str} – {txn_type} – {cat} – {CURRENCY} {amt:.2f}"
+        for date_str, txn_type, cat, amt in zip(
+            df["Date"].dt.strftime("%Y-%m-%d"), df["Type"], df["Category"], df["Amount"]
+        )
+    ]
     edited_index = st.selectbox(
         "Select a transaction to edit/delete",
         df.index,
-        format_func=lambda x: f"{df.at[x, 'Date'].date()} – {df.at[x, 'Type']} – {df.at[x, 'Category']} – Rs. {df.at[x, 'Amount']}"
+        format_func=lambda x: labels[x]
     )
 
     col1, col2 = st.columns(2)
     with col1:
         if st.button("🗑 Delete Transaction"):
             df = df.drop(index=edited_index).reset_index(drop=True)
-            df.to_csv(filename, index=False)
+            save_df(df, filename, pending_filename, aggregates_filename)
             st.success("Transaction deleted.")
             st.rerun()
 
     with col2:
         with st.expander("✏️ Edit Transaction Details"):
-            new_type = st.selectbox("New Type", ["Income", "Expense"], index=["Income", "Expense"].index(df.at[edited_index, "Type"]))
+            new_type = st.selectbox("New Type", TRANSACTION_TYPES, index=TRANSACTION_TYPES.index(df.at[edited_index, "Type"]))
             new_category = st.text_input("New Category", value=df.at[edited_index, "Category"])
             new_amount = st.number_input("New Amount", value=float(df.at[edited_index, "Amount"]), min_value=0.0, format="%.2f")
             new_date = st.date_input("New Date", value=df.at[edited_index, "Date"].date())
             if st.button("✅ Save Changes"):
                 df.at[edited_index, "Type"] = new_type
-                df.at[edited_index, "Category"] = new_category.strip().title()
+                new_category = new_category.strip().title()
+                if new_category not in df["Category"].cat.categories:
+                    df["Category"] = df["Category"].cat.add_categories([new_category])
+                df.at[edited_index, "Category"] = new_category
                 df.at[edited_index, "Amount"] = new_amount
                 df.at[edited_index, "Date"] = pd.to_datetime(str(new_date))
-                df.to_csv(filename, index=False)
+                save_df(df, filename, pending_filename, aggregates_filename)
                 st.success("Transaction updated.")
                 st.rerun()
 
-# ----- Dashboard -----
-if not df.empty:
+def render_summary(df, aggregates, aggregates_version, username, user_slug):
     st.subheader("📋 Transaction History")
-    st.dataframe(df.sort_values("Date"), use_container_width=True)
+    st.dataframe(df, use_container_width=True)
 
-    income = df[df["Type"] == "Income"]["Amount"].sum()
-    expenses = df[df["Type"] == "Expense"]["Amount"].sum()
+    income, expenses, pie_data = compute_summary(aggregates, aggregates_version)
     balance = income - expenses
 
     st.subheader("📊 Financial Summary")
-    st.markdown(f"**💰 Total Income:** Rs. {income:.2f}")
-    st.markdown(f"**💸 Total Expenses:** Rs. {expenses:.2f}")
-    st.markdown(f"**🧾 Current Balance:** Rs. {balance:.2f}")
+    st.markdown(f"**💰 Total Income:** {CURRENCY} {income:.2f}")
+    st.markdown(f"**💸 Total Expenses:** {CURRENCY} {expenses:.2f}")
+    st.markdown(f"**🧾 Current Balance:** {CURRENCY} {balance:.2f}")
 
     # Pie Chart
     st.subheader("📌 Category-wise Expense Breakdown")
-    pie_data = df[df["Type"] == "Expense"].groupby("Category")["Amount"].sum()
     if not pie_data.empty:
-        fig1, ax1 = plt.subplots()
-        ax1.pie(pie_data, labels=pie_data.index, autopct="%1.1f%%", startangle=90)
-        ax1.axis("equal")
-        st.pyplot(fig1)
+        st.image(make_pie(tuple(pie_data.items())), width="stretch")
     else:
         st.info("No expense data available.")
 
     # Line Chart
     st.subheader("📈 Financial Trends Over Time")
-    trend = df.groupby(["Date", "Type"])["Amount"].sum().unstack().fillna(0)
-    st.line_chart(trend)
+    trend = compute_trend(aggregates, aggregates_version)
+    st.vega_lite_chart(trend, {
+        "mark": "line",
+        "encoding": {
+            "x": {"field": "Date", "type": "temporal"},
+            "y": {"field": "Amount", "type": "quantitative"},
+            "color": {"field": "Type", "type": "nominal"}
+        }
+    }, width="stretch")
 
     # ----- PDF Report Download -----
     st.subheader("📥 Download Report")
+    if st.button("⬇️ Generate PDF Report"):
+        pdf_bytes = generate_pdf(username, df, income, expenses, balance)
+        st.download_button(
+            "📄 Click here to download your report",
+            data=pdf_bytes,
+            file_name=f"{user_slug}_budget_report.pdf",
+            mime="application/pdf"
+        )
 
-    def generate_pdf(dataframe, total_income, total_expenses, balance_amt):
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-
-        pdf.cell(200, 10, f"{username.title()}'s Budget Report", ln=True, align="C")
-        pdf.ln(10)
-
-        pdf.cell(200, 10, f"Total Income: Rs. {total_income:.2f}", ln=True)
-        pdf.cell(200, 10, f"Total Expenses: Rs. {total_expenses:.2f}", ln=True)
-        pdf.cell(200, 10, f"Current Balance: Rs. {balance_amt:.2f}", ln=True)
-        pdf.ln(10)
-
-        pdf.set_font("Arial", size=10)
-        pdf.cell(40, 10, "Date", border=1)
-        pdf.cell(30, 10, "Type", border=1)
-        pdf.cell(60, 10, "Category", border=1)
-        pdf.cell(30, 10, "Amount", border=1)
-        pdf.ln()
-
-        for _, row in dataframe.iterrows():
-            pdf.cell(40, 10, str(row["Date"].date()), border=1)
-            pdf.cell(30, 10, row["Type"], border=1)
-            pdf.cell(60, 10, row["Category"], border=1)
-            pdf.cell(30, 10, f"Rs. {row['Amount']:.2f}", border=1)
-            pdf.ln()
-
-        output_path = f"{username.lower().replace(' ', '_')}_budget_report.pdf"
-        pdf.output(output_path)
-        return output_path
+# ----- User Login -----
+st.sidebar.header("👤 User Login")
+username = st.sidebar.text_input("Enter your name to continue")
 
-    if st.button("⬇️ Generate PDF Report"):
-        report_path = generate_pdf(df, income, expenses, balance)
-        with open(report_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-            href = f'<a href="data:application/octet-stream;base64,{b64}" download="{report_path}">📄 Click here to download your report</a>'
-            st.markdown(href, unsafe_allow_html=True)
+if not username:
+    st.warning("Please enter your name in the sidebar to proceed.")
+    st.stop()
+
+log_user(username)
+
+user_slug = username.lower().replace(' ', '_')
+filename = f"{user_slug}_transactions.parquet"
+legacy_filename = f"{user_slug}_transactions.csv"
+# New transactions until the next full rewrite of the Parquet file
+pending_filename = f"{user_slug}_pending.csv"
+# Running totals behind the summary and charts
+aggregates_filename = f"{user_slug}_aggregates.json"
+
+df, aggregates, aggregates_version = load_user_data(filename, pending_filename, legacy_filename, aggregates_filename)
+
+# ----- Add Transaction -----
+render_add_form(filename, pending_filename, aggregates_filename)
+
+# ----- Edit/Delete Transactions -----
+if not df.empty:
+    render_edit_form(df, filename, pending_filename, aggregates_filename)
 
+# ----- Dashboard -----
+if not df.empty:
+    render_summary(df, aggregates, aggregates_version, username, user_slug)
 else:
     st.info("No transactions recorded yet.")